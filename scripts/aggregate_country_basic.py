@@ -15,11 +15,34 @@
 # -------------------------------------------------------------------
 
 import argparse
+import sys
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow  # noqa: F401  (lets pandas use Arrow's multithreaded CSV reader)
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+CSV_ENGINE = "pyarrow" if HAVE_PYARROW else "c"
+
+def read_matched(path: str, used_cols: set[str], dtype: dict[str, str]) -> pd.DataFrame:
+    # only parse the columns the summaries below actually use
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        return pd.read_parquet(path, columns=[c for c in names if c in used_cols])
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in used_cols]
+    try:
+        return pd.read_csv(path, usecols=usecols, dtype=dtype, engine=CSV_ENGINE)
+    except ValueError:
+        # a stray non-numeric value (e.g. "n/a?"); main() coerces after an untyped read
+        return pd.read_csv(path, usecols=usecols, engine=CSV_ENGINE)
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("matched_csv")
+    ap.add_argument("matched_csv", help="matcher output, .csv or .parquet")
     ap.add_argument("brand_summary_csv")
     ap.add_argument("shop_brand_csv")
     ap.add_argument("unmatched_csv")
@@ -29,27 +52,69 @@ def main():
     ap.add_argument("--units-col", default="Units Sold (Numeric)")
     args = ap.parse_args()
 
-    df = pd.read_csv(args.matched_csv)
+    if args.matched_csv.lower().endswith(".parquet") and not HAVE_PYARROW:
+        print("Reading .parquet input requires pyarrow (pip install pyarrow)", file=sys.stderr)
+        sys.exit(1)
 
-    # coerce numerics if present
-    for c in [args.price_col, args.units_col, "Revenue (USD)"]:
-        if c in df.columns:
+    used_cols = {
+        args.brand_col, args.shop_col, args.price_col, args.units_col,
+        "Brand (Matched)", "Revenue (USD)", "Shop", "Listing", "Listing (Cleaned)", "Match Score",
+    }
+    # numerics are typed at parse time (Parquet input already carries its types)
+    numeric = dict.fromkeys([args.price_col, args.units_col, "Revenue (USD)"], "float64")
+    try:
+        df = read_matched(args.matched_csv, used_cols, numeric)
+    except Exception as e:
+        print(f"Failed to read matched file: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # coerce whatever didn't come through typed (odd values become NaN)
+    for c in numeric:
+        if c in df.columns and not pd.api.types.is_numeric_dtype(df[c]):
             df[c] = pd.to_numeric(df[c], errors="coerce")
 
+    # group keys as categoricals so the groupbys hash int codes, not strings
+    for c in [args.brand_col, args.shop_col]:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+
     # Brand summary
     if "Revenue (USD)" not in df.columns and all(c in df.columns for c in [args.price_col, args.units_col]):
-        df["Revenue (USD)"] = df[args.price_col].fillna(0) * df[args.units_col].fillna(0)
+        rev = df[args.price_col].to_numpy(dtype="float64") * df[args.units_col].to_numpy(dtype="float64")
+        rev[np.isnan(rev)] = 0.0
+        df["Revenue (USD)"] = rev
 
-    brand_grp = (
-        df.groupby(args.brand_col, dropna=False)
+    # Single pass over the rows at Shop x Brand grain; the brand summary is
+    # rolled up from that much smaller table
+    # observed=True: brand/shop are categoricals, and pandas < 3 would otherwise
+    # build every shop/brand level pair, empty ones included
+    has_shop = args.shop_col in df.columns
+    shop_brand = (
+        df.groupby([args.shop_col, args.brand_col] if has_shop else [args.brand_col], dropna=False, observed=True)
           .agg(
-              listings=("Listing", "count") if "Listing" in df.columns else ("Brand (Matched)", "count"),
+              listings=("Listing", "count") if "Listing" in df.columns else (args.brand_col, "count"),
               units=(args.units_col, "sum"),
               revenue=("Revenue (USD)", "sum"),
-              avg_price=(args.price_col, "mean")
+              price_sum=(args.price_col, "sum"),
+              price_n=(args.price_col, "count")
+          )
+          .reset_index()
+    )
+
+    brand_grp = (
+        shop_brand.groupby(args.brand_col, dropna=False, observed=True)
+          .agg(
+              listings=("listings", "sum"),
+              units=("units", "sum"),
+              revenue=("revenue", "sum"),
+              price_sum=("price_sum", "sum"),
+              price_n=("price_n", "sum")
           )
           .reset_index()
     )
+    # summing leaves float noise; revenue is reported in cents, same as the matcher
+    brand_grp["revenue"] = brand_grp["revenue"].round(2)
+    brand_grp["avg_price"] = brand_grp.pop("price_sum") / brand_grp.pop("price_n")
 
     # Sort by revenue desc
     brand_grp = brand_grp.sort_values("revenue", ascending=False)
@@ -57,26 +122,18 @@ def main():
     print(f"✓ Wrote {args.brand_summary_csv}")
 
     # Shop x Brand view
-    if args.shop_col in df.columns:
-        shop_brand = (
-            df.groupby([args.shop_col, args.brand_col], dropna=False)
-              .agg(
-                  listings=("Listing", "count") if "Listing" in df.columns else (args.brand_col, "count"),
-                  units=(args.units_col, "sum"),
-                  revenue=("Revenue (USD)", "sum")
-              )
-              .reset_index()
-              .sort_values(["revenue"], ascending=False)
-        )
+    if has_shop:
+        shop_brand = shop_brand.drop(columns=["price_sum", "price_n"])
+        shop_brand["revenue"] = shop_brand["revenue"].round(2)
+        shop_brand = shop_brand.sort_values(["revenue"], ascending=False)
         shop_brand.to_csv(args.shop_brand_csv, index=False)
         print(f"✓ Wrote {args.shop_brand_csv}")
 
-    # Unmatched for review
-    um = df[df[args.brand_col].eq("no brand")].copy()
+    # Unmatched for review (brand is categorical, so this compares codes)
+    unmatched = df[args.brand_col].eq("no brand")
     # keep only the most useful columns, if they exist
-    keep_cols = [c for c in ["Shop", "Listing", "Listing (Cleaned)", args.units_col, args.price_col, "Match Score"] if c in um.columns]
-    if keep_cols:
-        um = um[keep_cols]
+    keep_cols = [c for c in ["Shop", "Listing", "Listing (Cleaned)", args.units_col, args.price_col, "Match Score"] if c in df.columns]
+    um = df.loc[unmatched, keep_cols] if keep_cols else df.loc[unmatched]
     um = um.sort_values("Match Score", ascending=False, na_position="last") if "Match Score" in um.columns else um
     um.to_csv(args.unmatched_csv, index=False)
     print(f"✓ Wrote {args.unmatched_csv}")
@@ -1,76 +1,152 @@
 import argparse
-import re
 import sys
 from unidecode import unidecode
+import ahocorasick
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
-
-def norm(s: str) -> str:
-    if pd.isna(s):
-        return ""
-    s = unidecode(str(s)).lower()
+from rapidfuzz import fuzz, process
+
+# rows per full-keyspace cdist call; bounds each score matrix to chunk x keys
+SCORE_CHUNK_ROWS = 10_000
+
+def norm(s: pd.Series) -> pd.Series:
+    s = s.fillna("").astype(str)
+    # transliterate only the cells that need it; ASCII passes through unidecode unchanged
+    non_ascii = s.str.contains(r"[^\x00-\x7f]", regex=True)
+    if non_ascii.any():
+        s = s.copy()
+        s[non_ascii] = s[non_ascii].map(unidecode)
+    s = s.str.lower()
     # keep letters/numbers/spaces; drop everything else
-    s = re.sub(r"[^a-z0-9\s]+", " ", s)
+    s = s.str.replace(r"[^a-z0-9\s]+", " ", regex=True)
     # squash whitespace
-    s = re.sub(r"\s+", " ", s).strip()
+    s = s.str.replace(r"\s+", " ", regex=True).str.strip()
     return s
 
-def compact(s: str) -> str:
-    return s.replace(" ", "") if s else s
+def compact(s: pd.Series) -> pd.Series:
+    return s.str.replace(" ", "", regex=False)
 
 def build_brand_keyspace(brands_df: pd.DataFrame) -> pd.DataFrame:
     # Expect columns: brand, key
     out = brands_df.copy()
-    out["key_norm"] = out["key"].fillna("").map(norm)
-    out["key_compact"] = out["key_norm"].map(compact)
+    out["key_norm"] = norm(out["key"])
+    out["key_compact"] = compact(out["key_norm"])
     # Drop empties/dupes
     out = out[(out["key_norm"] != "") & (out["brand"] != "")]
     out = out.drop_duplicates(subset=["brand", "key_norm"])
     return out
 
-def score_listing_against_key(list_norm: str, list_compact: str, key_norm: str, key_compact: str) -> int:
+def build_automaton(keys: np.ndarray) -> ahocorasick.Automaton:
+    # Multi-pattern substring matcher; several brands can share the same key
+    words: dict[str, list[int]] = {}
+    for idx, k in enumerate(keys):
+        words.setdefault(k, []).append(idx)
+    A = ahocorasick.Automaton()
+    for k, idxs in words.items():
+        A.add_word(k, idxs)
+    A.make_automaton()
+    return A
+
+def shortlist(list_norm: str, list_compact: str, A_norm: ahocorasick.Automaton, A_compact: ahocorasick.Automaton) -> list[int]:
+    # Keys that appear as substring in norm/compact, in keyspace order
+    cand_idx = {i for _, idxs in A_norm.iter(list_norm) for i in idxs}
+    cand_idx |= {i for _, idxs in A_compact.iter(list_compact) for i in idxs}
+    return sorted(cand_idx)
+
+def score_listing_against_key(list_norm: str, list_compact: str, key_norm: str, key_compact: str) -> float:
     # Try multiple similarity views; take the best
-    s1 = fuzz.partial_ratio(list_norm, key_norm)
-    s2 = fuzz.token_set_ratio(list_norm, key_norm)
     # compact vs compact to forgive space differences completely
     s3 = fuzz.partial_ratio(list_compact, key_compact)
+    if s3 == 100:
+        # nothing can beat a perfect score, skip the other views
+        return s3
+    s1 = fuzz.partial_ratio(list_norm, key_norm)
+    s2 = fuzz.token_set_ratio(list_norm, key_norm)
     return max(s1, s2, s3)
 
-def best_brand(list_norm: str, list_compact: str, brand_keys: pd.DataFrame) -> tuple[str | None, int, str | None]:
-    best = (None, 0, None)  # (brand, score, matched_key_norm)
-    # Optional fast prefilter: shortlist keys that appear as substring in norm/compact
-    sub = brand_keys[
-        brand_keys["key_norm"].apply(lambda k: k in list_norm) |
-        brand_keys["key_compact"].apply(lambda k: k in list_compact)
-    ]
-    candidates = sub if len(sub) else brand_keys
-
-    for _, row in candidates.iterrows():
-        sc = score_listing_against_key(list_norm, list_compact, row["key_norm"], row["key_compact"])
-        if sc > best[1]:
-            best = (row["brand"], sc, row["key_norm"])
-    return best
+def score_matrix(list_norm: np.ndarray, list_compact: np.ndarray, key_norm: np.ndarray, key_compact: np.ndarray, workers: int = -1) -> np.ndarray:
+    # Try multiple similarity views for every listing x key pair; take the best
+    mat = process.cdist(list_norm, key_norm, scorer=fuzz.partial_ratio, workers=workers, dtype=np.float64)
+    np.maximum(mat, process.cdist(list_norm, key_norm, scorer=fuzz.token_set_ratio, workers=workers, dtype=np.float64), out=mat)
+    # compact vs compact to forgive space differences completely
+    np.maximum(mat, process.cdist(list_compact, key_compact, scorer=fuzz.partial_ratio, workers=workers, dtype=np.float64), out=mat)
+    return mat
+
+def best_brand(list_norm: np.ndarray, list_compact: np.ndarray, brand_keys: pd.DataFrame, workers: int = -1) -> tuple[np.ndarray, np.ndarray]:
+    # Returns (best key index, best score) per listing
+    best_idx = np.zeros(len(list_norm), dtype=np.intp)
+    best_score = np.zeros(len(list_norm), dtype=np.float64)
+    if brand_keys.empty:
+        # no keys to match against; everything ends up as "no brand"
+        return best_idx, best_score
+
+    key_norm = brand_keys["key_norm"].to_numpy()
+    key_compact = brand_keys["key_compact"].to_numpy()
+    A_norm = build_automaton(key_norm)
+    A_compact = build_automaton(key_compact)
+    no_sub = []
+
+    # Fast prefilter: only score the shortlisted keys when there are any
+    for i, (ln, lc) in enumerate(zip(list_norm, list_compact)):
+        if not lc:
+            # nothing to score; every view gives 0
+            continue
+        cand_idx = shortlist(ln, lc, A_norm, A_compact)
+        if not cand_idx:
+            no_sub.append(i)
+            continue
+        best = (0, 0.0)  # (key index, score)
+        for j, kn, kc in zip(cand_idx, key_norm[cand_idx], key_compact[cand_idx]):
+            sc = score_listing_against_key(ln, lc, kn, kc)
+            if sc > best[1]:
+                best = (j, sc)
+                if sc == 100:
+                    break
+        best_idx[i], best_score[i] = best
+
+    # Everything else is scored against the full keyspace, a chunk of rows
+    # at a time so the score matrix stays bounded
+    no_sub = np.asarray(no_sub, dtype=np.intp)
+    for start in range(0, len(no_sub), SCORE_CHUNK_ROWS):
+        rows = no_sub[start:start + SCORE_CHUNK_ROWS]
+        mat = score_matrix(list_norm[rows], list_compact[rows], key_norm, key_compact, workers)
+        best_idx[rows] = mat.argmax(axis=1)
+        best_score[rows] = mat[np.arange(len(rows)), best_idx[rows]]
+    return best_idx, best_score
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("input_csv", help="e.g., data\\raw\\malaysia\\combined_my.csv")
     ap.add_argument("brands_csv", help="e.g., data\\brands\\brands_master.csv")
-    ap.add_argument("output_csv", help="e.g., data\\processed\\malaysia_matched.csv")
+    ap.add_argument("output_csv", help="e.g., data\\processed\\malaysia_matched.csv (or .parquet)")
     ap.add_argument("--listing-col", default="Listing (Cleaned)")
     ap.add_argument("--price-col", default="Price (USD)")
     ap.add_argument("--units-col", default="Units Sold (Numeric)")
     ap.add_argument("--threshold", type=int, default=85, help="min match score to accept")
+    ap.add_argument("--workers", type=int, default=-1, help="threads for fuzzy scoring (-1 = all cores)")
     args = ap.parse_args()
 
+    if args.output_csv.lower().endswith(".parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("Writing .parquet output requires pyarrow (pip install pyarrow)", file=sys.stderr)
+            sys.exit(1)
+
     # Load
     try:
-        df = pd.read_csv(args.input_csv)
+        try:
+            # numerics are typed once here rather than coerced later
+            df = pd.read_csv(args.input_csv, dtype={args.price_col: "float64", args.units_col: "float64"})
+        except ValueError:
+            # stray non-numeric price/units (e.g. "$1.00"); load untyped, revenue coerces below
+            df = pd.read_csv(args.input_csv)
     except Exception as e:
         print(f"Failed to read input CSV: {e}", file=sys.stderr)
         sys.exit(1)
 
     try:
-        brands = pd.read_csv(args.brands_csv)
+        brands = pd.read_csv(args.brands_csv, usecols=lambda c: c in ("brand", "key"))
     except Exception as e:
         print(f"Failed to read brands CSV: {e}", file=sys.stderr)
         sys.exit(1)
@@ -84,47 +160,43 @@ def main():
         print("brands_master.csv must have columns: brand,key", file=sys.stderr)
         sys.exit(1)
 
-    # Prep fields
-    df["__list_norm"] = df[args.listing_col].fillna("").map(norm)
-    df["__list_compact"] = df["__list_norm"].map(compact)
+    # Prep fields (kept off df so nothing needs cleaning up before saving)
+    list_norm = norm(df[args.listing_col])
 
     brand_keys = build_brand_keyspace(brands)
 
-    # Match
-    matched_brand = []
-    match_score = []
-    matched_key = []
-
-    for ln, lc in zip(df["__list_norm"], df["__list_compact"]):
-        b, sc, keyn = best_brand(ln, lc, brand_keys)
-        if b is not None and sc >= args.threshold:
-            matched_brand.append(b)
-            match_score.append(sc)
-            matched_key.append(keyn)
-        else:
-            matched_brand.append("no brand")
-            match_score.append(sc)
-            matched_key.append(keyn)
+    # Match each distinct listing once, then fan the results back out
+    codes, uniq_norm = pd.factorize(list_norm)
+    uniq_compact = compact(pd.Series(uniq_norm))
+    best_idx, best_score = best_brand(uniq_norm.to_numpy(), uniq_compact.to_numpy(), brand_keys, args.workers)
+    best_idx, best_score = best_idx[codes], best_score[codes]
+    found = best_score > 0
+    accepted = found & (best_score >= args.threshold)
+
+    matched_brand = np.full(len(df), "no brand", dtype=object)
+    matched_brand[accepted] = brand_keys["brand"].to_numpy()[best_idx[accepted]]
+    matched_key = np.full(len(df), None, dtype=object)
+    matched_key[found] = brand_keys["key_norm"].to_numpy()[best_idx[found]]
 
     df["Brand (Matched)"] = matched_brand
-    df["Match Score"] = match_score
+    df["Match Score"] = best_score
     df["Matched Key"] = matched_key
 
     # Optional convenience: revenue if columns exist
     if args.price_col in df.columns and args.units_col in df.columns:
-        try:
-            df["__price"] = pd.to_numeric(df[args.price_col], errors="coerce")
-            df["__units"] = pd.to_numeric(df[args.units_col], errors="coerce")
-            df["Revenue (USD)"] = (df["__price"].fillna(0) * df["__units"].fillna(0)).round(2)
-        except Exception:
-            # don't fail the whole run if types are odd
-            pass
-
-    # Clean internals
-    df = df.drop(columns=[c for c in df.columns if c.startswith("__")], errors="ignore")
-
-    # Save
-    df.to_csv(args.output_csv, index=False)
+        # one product buffer; a missing price or unit count means no revenue
+        # (to_numeric is a no-op on the typed fast path; odd values become NaN)
+        price = pd.to_numeric(df[args.price_col], errors="coerce").to_numpy(dtype="float64")
+        units = pd.to_numeric(df[args.units_col], errors="coerce").to_numpy(dtype="float64")
+        rev = price * units
+        rev[np.isnan(rev)] = 0.0
+        df["Revenue (USD)"] = rev.round(2)
+
+    # Save (.parquet keeps column types for the aggregation step)
+    if args.output_csv.lower().endswith(".parquet"):
+        df.to_parquet(args.output_csv, engine="pyarrow", compression="zstd", index=False)
+    else:
+        df.to_csv(args.output_csv, index=False)
     print(f"✓ Wrote {args.output_csv}")
 
 if __name__ == "__main__":